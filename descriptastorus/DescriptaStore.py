@@ -213,8 +213,9 @@ class DescriptaStore:
         """key -> returns the indicies of the inchi key"""
         if self.inchikey is None:
             raise ValueError("Inchi index not available")
-        res = self.inchikey.get(key)
+        res = self.inchikey.get_index(key)
         if res is None:
             raise KeyError(key)
-        return res
+        # indices are stored as results come back from the workers
+        return sorted(res)
     
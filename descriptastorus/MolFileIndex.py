@@ -31,13 +31,20 @@
 from __future__ import print_function
 from rdkit.Chem import AllChem
 
-import os, numpy, sys
+import os, numpy, sys, mmap
 from . import raw
 import logging, shutil, pickle
-import csv
+import csv, re
 from io import StringIO
 import functools
 
+try:
+    import numba
+    prange = numba.prange
+except:
+    numba = None
+    prange = range
+
 logger = logging.getLogger("descriptastorus")
 
 def SDFNameGetter(buffer):
@@ -71,6 +78,46 @@ def reader(s, dialect=None):
 def whitespace_reader(s):
     return [s.split()]
 
+def field_parser(sep, cols, split):
+    """sep, cols, split -> parser(bytes) returning columns cols of a row
+    (a single string for one column, a tuple otherwise)
+
+    The seperator and columns are bound once so a row is cut with one
+    bytes.split instead of going through the csv reader.  This matches a
+    single character delimiter with skipinitialspace; rows the csv reader
+    treats differently (quotes, carriage returns, blank or short rows)
+    are handed unchanged to split(bytes), the full csv parser."""
+    n = max(cols) + 1
+    if sep == b" ":
+        # skipinitialspace turns runs of spaces into one seperator
+        spaces = re.compile(b" +").split
+        def cut(buf):
+            return spaces(buf.lstrip(b" "), n)
+    else:
+        def cut(buf):
+            return buf.split(sep, n)
+
+    if len(cols) == 1:
+        col = cols[0]
+        def parse(row):
+            buf = row[:-1] if row[-1:] == b"\r" else row
+            if buf and b'"' not in buf and b"\r" not in buf:
+                fields = cut(buf)
+                if len(fields) >= n:
+                    return fields[col].lstrip(b" ").decode("utf-8")
+            return split(row)[col]
+        return parse
+
+    def parse(row):
+        buf = row[:-1] if row[-1:] == b"\r" else row
+        if buf and b'"' not in buf and b"\r" not in buf:
+            fields = cut(buf)
+            if len(fields) >= n:
+                return tuple(fields[col].lstrip(b" ").decode("utf-8") for col in cols)
+        fields = split(row)
+        return tuple(fields[col] for col in cols)
+    return parse
+
 class MolFileIndex:
     """Index for a molecule file to provide random access to the internal molecules.
     """
@@ -100,6 +147,8 @@ class MolFileIndex:
         self.nameColumn = options['nameColumn']
         self.sep = options['sep']
         self.nameFxnName = options['nameFxnName']
+        # single byte seperator for cutting rows with field_parser
+        self._sepByte = None
 
         try:
             if self.sep == None:
@@ -115,20 +164,32 @@ class MolFileIndex:
                 # assume a seperator
                 csv.register_dialect('custom_dialect', delimiter=self.sep, skipinitialspace=True)
                 self.reader = functools.partial(reader, dialect='custom_dialect')
+                if len(self.sep) == 1:
+                    self._sepByte = self.sep.encode("utf-8")
         except:
             logger.exception("Can't initialize delimiter: %s", self.sep)
             
 
-        self.nameFxn = namefxns[self.nameFxnName]
+        self.nameFxn = self._nameGetter = namefxns[self.nameFxnName]
         
         if self.hasHeader:
             self.N = self.db.N - 3
         else:
             self.N = self.db.N - 2
 
-        # mmap?
-        self.filename = os.path.join(indexDirectory, self.filename)        
-        self.f = open(self.filename, 'r')
+        self.filename = os.path.join(indexDirectory, self.filename)
+        self.filesize = os.path.getsize(self.filename)
+        self.mm = self.fd = None
+        try:
+            with open(self.filename, 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # molecules are fetched by row index, readahead is wasted
+            if hasattr(self.mm, "madvise"):
+                self.mm.madvise(mmap.MADV_RANDOM)
+        except (ValueError, OSError):
+            # empty files or filesystems that can't be mapped
+            logger.debug("Can't mmap %s, using positional reads", self.filename)
+            self.fd = os.open(self.filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
         
         if self.hasHeader:
             colnames = self.colnames = self._get(None)
@@ -160,6 +221,10 @@ class MolFileIndex:
                                      self.smilesColIdx,
                                      len(row),
                                      self.sep))
+        else:
+            # raw molecule records (i.e. molfiles)
+            self.smilesColIdx = -1
+
         self.nameidx = -1
         if self.nameColumn is not None:
             try:
@@ -184,12 +249,32 @@ class MolFileIndex:
                                      len(row),
                                      self.sep))
 
+        if self.smilesColIdx != -1:
+            self._molField = self._parser(self.smilesColIdx)
+        if self.nameidx != -1:
+            self._nameField = self._parser(self.nameidx)
+            if self.smilesColIdx != -1:
+                self._molAndName = self._parser(self.smilesColIdx, self.nameidx)
+
+    def _parser(self, *cols):
+        """cols -> parser(bytes) for just those columns of a row"""
+        if self._sepByte is not None:
+            return field_parser(self._sepByte, cols, self._split)
+        if len(cols) == 1:
+            col = cols[0]
+            return lambda buf: self._split(buf)[col]
+        return lambda buf: tuple(self._split(buf)[col] for col in cols)
+
     def __del__(self):
         self.close()
         
     def close(self):
         self.db.close()
-        self.f.close()
+        if self.mm is not None:
+            self.mm.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
 
     def __len__(self):
         return self.N
@@ -197,16 +282,46 @@ class MolFileIndex:
     def __iter__(self):
         return MolFileIter(self)
         
+    def _read(self, start, end):
+        """Return the bytes [start, end) of the molecule file"""
+        if self.mm is not None:
+            return self.mm[start:end]
+        if hasattr(os, "pread"):
+            # one syscall and no shared file position
+            return os.pread(self.fd, end-start, start)
+        os.lseek(self.fd, start, os.SEEK_SET)
+        return os.read(self.fd, end-start)
+
     def _get(self, idx):
+        """idx -> row idx split into columns (or the raw record)"""
+        return self._split(self._getBytes(idx))
+
+    def _getBytes(self, idx):
+        """idx -> bytes of row idx
+        This is the per-molecule path behind get, getMol and getName."""
         if idx is None:
-            idx = 0
-        elif self.hasHeader:
-            idx += 1
-            
-        start = self.db.get(idx)[0]
-        end = self.db.get(idx+1)[0]
-        self.f.seek(start,0)
-        buf = self.f.read(end-start-1)
+            # the header is the line before row 0
+            idx = -1 if self.hasHeader else 0
+        start, end = self._rowOffsets(idx, idx+1)
+        return self._read(start, end-1)
+
+    def _rowOffsets(self, start, end):
+        """start, end -> file offsets of rows [start, end) plus the end offset
+        Row i spans offsets[i-start] up to the newline before offsets[i-start+1]."""
+        if self.hasHeader:
+            start += 1
+            end += 1
+        offsets = self.db.getRange(start, end+1)["index"].tolist()
+        if offsets[-1] <= offsets[-2]:
+            # last line without a trailing newline
+            offsets[-1] = self.filesize + 1
+        return offsets
+
+    def _split(self, buf):
+        """bytes -> row split into columns (or the raw record)"""
+        if buf[-1:] == b"\r":
+            buf = buf[:-1]
+        buf = buf.decode("utf-8")
         try:
             if self.smilesColumn != -1:
                 return list(self.reader(buf))[0]#buf.split(self.sep)
@@ -226,13 +341,11 @@ class MolFileIndex:
         return a list if the data is a smiles like file
         returns a string buffer otherwise
         """
-        v = self._get(idx)
         if self.smilesColIdx != -1:
-            moldata = v[self.smilesColIdx]
             if self.nameidx != -1:
-                name = v[self.nameidx]
-                return moldata, name
-            return moldata
+                return self._molAndName(self._getBytes(idx))
+            return self._molField(self._getBytes(idx))
+        v = self._get(idx)
         if self._nameGetter:
             return v, self._nameGetter(v)
         return v
@@ -240,9 +353,58 @@ class MolFileIndex:
     def getMol(self, idx):
         """Returns input data for the molecule"""
         if self.smilesColIdx != -1:
-            return self._get(idx)[self.smilesColIdx]
+            return self._molField(self._getBytes(idx))
         return self._get(idx)
 
+    def _getBatch(self, start, end):
+        """start, end -> rows [start, end) split into columns (or the raw records)"""
+        return [self._split(buf) for buf in self._getBatchBytes(start, end)]
+
+    def _getBatchBytes(self, start, end):
+        """start, end -> bytes of the rows [start, end)
+        The offsets and the text for the whole block are each read at once."""
+        if start >= end:
+            return []
+        offsets = self._rowOffsets(start, end)
+        first = offsets[0]
+        blob = self._read(first, offsets[-1]-1)
+        return [blob[lo-first:hi-first-1]
+                for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+    def prefetch(self, start, end):
+        """start, end -> hint to the kernel that rows [start, end) are read next
+        The file is advised for random access, so a block about to be read
+        in one go is asked for explicitly."""
+        if start >= end:
+            return
+        offsets = self._rowOffsets(start, end)
+        lo, hi = offsets[0], min(offsets[-1], self.filesize)
+        if hi <= lo:
+            return
+        if self.mm is not None:
+            if hasattr(mmap, "MADV_WILLNEED"):
+                lo -= lo % mmap.PAGESIZE
+                self.mm.madvise(mmap.MADV_WILLNEED, lo, hi - lo)
+        elif hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, lo, hi - lo, os.POSIX_FADV_WILLNEED)
+
+    def getBatch(self, start, end):
+        """start, end -> the data (see get) for the rows [start, end)"""
+        if self.smilesColIdx != -1:
+            if self.nameidx != -1:
+                return list(map(self._molAndName, self._getBatchBytes(start, end)))
+            return self.getMolBatch(start, end)
+        rows = self._getBatch(start, end)
+        if self._nameGetter:
+            return [(v, self._nameGetter(v)) for v in rows]
+        return rows
+
+    def getMolBatch(self, start, end):
+        """start, end -> input data for the molecules in rows [start, end)"""
+        if self.smilesColIdx != -1:
+            return list(map(self._molField, self._getBatchBytes(start, end)))
+        return self._getBatch(start, end)
+
     def getRDMol(self, idx):
         """Returns the RDKit molecular representation of the input data"""
         data = self._get(idx)
@@ -261,36 +423,87 @@ class MolFileIndex:
             
             raise ValueError("SmilesIndex does not have a name column or a name retriever")
         
-        return self._get(idx)[self.nameidx]
-
-def simplecount(filename):
-    lines = 0
-    with open(filename) as f:
-        for line in f:
-            lines += 1
-    return lines
-
-def index(fname, word):
-    fsize = os.path.getsize(fname)
-    bsize = 2**16
-    
+        return self._nameField(self._getBytes(idx))
+
+def _scan(buf, needle, m, nparts):
+    """buf, needle, m, nparts -> int64 array of the offsets < m where needle
+    starts in buf
+    The range is cut into nparts pieces which are counted, then filled
+    in at their exclusive prefix sum (both passes in parallel under numba)."""
+    width = needle.shape[0]
+    step = (m + nparts - 1) // nparts
+    counts = numpy.zeros(nparts + 1, dtype=numpy.int64)
+    for p in prange(nparts):
+        c = 0
+        for i in range(p*step, min(m, (p+1)*step)):
+            if buf[i] == needle[0]:
+                k = 1
+                while k < width and buf[i+k] == needle[k]:
+                    k += 1
+                if k == width:
+                    c += 1
+        counts[p+1] = c
+
+    for p in range(nparts):
+        counts[p+1] += counts[p]
+    out = numpy.empty(counts[nparts], dtype=numpy.int64)
+
+    for p in prange(nparts):
+        j = counts[p]
+        for i in range(p*step, min(m, (p+1)*step)):
+            if buf[i] == needle[0]:
+                k = 1
+                while k < width and buf[i+k] == needle[k]:
+                    k += 1
+                if k == width:
+                    out[j] = i
+                    j += 1
+    return out
+
+if numba is not None:
+    _scan = numba.njit(parallel=True, cache=True)(_scan)
+
+# chunks smaller than this aren't worth handing to numba's threads
+NUMBA_MIN_SCAN = 2**22
+
+def findall(fname, word, chunksize=2**26):
+    """fname, word -> numpy array of the byte offsets of every occurrence of word
+    The file is memory mapped and scanned chunksize bytes at a time
+    (with numba, large chunks are scanned across threads)."""
+    size = os.path.getsize(fname)
+    width = len(word)
+    if size < width:
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    needle = numpy.frombuffer(word, dtype=numpy.uint8)
     with open(fname, 'rb') as f:
-
-        buffer = None
-        overlap = len(word) - 1
-        while True:
-            if (f.tell() >= overlap and f.tell() < fsize):
-                f.seek(f.tell() - overlap)
-            buffer = f.read(bsize)
-            if buffer:
-                pos = buffer.find(word)
-                while pos != -1:
-                    yield f.tell() - (len(buffer) - pos)
-                    pos = buffer.find(word, pos+1)
-                
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        # one front to back pass, read ahead as far as the kernel likes
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        positions = []
+        for start in range(0, size - width + 1, chunksize):
+            # chunks overlap by width-1 bytes so that matches
+            #  spanning a chunk boundary are found exactly once
+            count = min(chunksize + width - 1, size - start)
+            buf = numpy.frombuffer(mm, dtype=numpy.uint8,
+                                   count=count, offset=start)
+            m = count - width + 1
+            if numba is not None and m >= NUMBA_MIN_SCAN:
+                positions.append(_scan(buf, needle, m,
+                                       4 * numba.get_num_threads()) + start)
             else:
-                break
-    
+                hits = buf[:m] == needle[0]
+                for k in range(1, width):
+                    hits &= buf[k:k+m] == needle[k]
+                positions.append(numpy.flatnonzero(hits) + start)
+            # the mmap can't be closed while a view is exported
+            del buf
+    finally:
+        mm.close()
+    return numpy.concatenate(positions)
+
 def MakeSmilesIndex(filename, dbdir, hasHeader, smilesColumn, nameColumn=-1, sep=None,
                     reIndex=False):
     """Make smiles index -> index a smiles file for random access
@@ -307,8 +520,14 @@ def MakeSmilesIndex(filename, dbdir, hasHeader, smilesColumn, nameColumn=-1, sep
         raise ValueError("If reindex is set, filename must be the storage filename (this is a sanity check\n%s\n%s"%(filename, targetFilename))
     
     sz = os.path.getsize(filename)
-    
-    N = simplecount(filename)
+
+    # one pass over the file gives both the line count and the offsets
+    #  (the copy below is byte for byte identical)
+    pos = findall(filename, b"\n")
+    N = len(pos)
+    if sz and (not N or pos[-1] != sz - 1):
+        # last line has no newline
+        N += 1
 
     if sz < 2**8:
         dtype = numpy.uint8
@@ -345,9 +564,10 @@ def MakeSmilesIndex(filename, dbdir, hasHeader, smilesColumn, nameColumn=-1, sep
     # first row
     #  TODO sniff newline...
     logger.info("Indexing...")
-    db.putRow(0, [0])
-    for i,pos in enumerate(index(cpfile, b"\n")):
-        db.putRow(i+1, [pos+1])
+    # rows are the start of each line, the first row is 0
+    offsets = numpy.zeros(N+2, dtype=dtype)
+    offsets[1:len(pos)+1] = pos + 1
+    db.putRows(0, offsets)
     db.close()
     return MolFileIndex(dbdir)
 #, os.path.basename(filename), smilesColumn,
@@ -355,11 +575,20 @@ def MakeSmilesIndex(filename, dbdir, hasHeader, smilesColumn, nameColumn=-1, sep
 #                        sep=sep)
 
 def MakeSDFIndex(filename, dbdir):
-    """Make smiles index -> index a smiles file for random access"""
-    sadf
+    """Make sdf index -> index an sdf file for random access
+    filename: filename to index
+    dbdir: name of the index store
+    Copies file over to index"""
     sz = os.path.getsize(filename)
-    
-    N = simplecount(filename)
+
+    # TODO sniff newline ...
+    delim = b"$$$$\n"
+    ends = findall(filename, delim) + len(delim)
+    N = len(ends)
+    if sz and (not N or ends[-1] != sz):
+        # last record has no delimiter
+        N += 1
+
     if sz < 2**8:
         dtype = numpy.uint8
     elif sz < 2**16:
@@ -369,16 +598,25 @@ def MakeSDFIndex(filename, dbdir):
     else:
         dtype = numpy.uint64
 
-    # TODO sniff newline ...
-    indices = list(index(filename, b"$$$$\n"))
-    
-    db = raw.MakeStore([("index", dtype)], N+1, dbdir)
+    db = raw.MakeStore([("index", dtype)], N+2, dbdir)
+    logger.info("Copying molecule file to index...")
+    shutil.copy(filename, os.path.join(dbdir, os.path.basename(filename)))
+    logger.info("Done copying")
 
-    # first row
-    db.putRow(0, [0])
-    for i, idx in enumerate(indices):
-        db.putRow(i+1, [pos+1])
-    
-    return MolFileIndex(filename, dbdir, nameFxn=SDFNameGetter)
+    options = {'filename': os.path.basename(filename),
+               'hasHeader': False,
+               'smilesColumn': -1,
+               'nameColumn': None,
+               'nameFxnName': "molfile",
+               'sep': None}
 
-        
+    with open(nameOptFile(dbdir), 'wb') as f:
+        pickle.dump(options, f)
+
+    # rows are the start of each record, the first row is 0
+    logger.info("Indexing...")
+    offsets = numpy.zeros(N+2, dtype=dtype)
+    offsets[1:len(ends)+1] = ends
+    db.putRows(0, offsets)
+    db.close()
+    return MolFileIndex(dbdir)
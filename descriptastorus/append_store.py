@@ -35,8 +35,9 @@ from rdkit.Chem import AllChem
 import pickle
 import time, os, sys, numpy, shutil
 import logging
-from .make_store import (process, processInchi, getJobsAndNames, getJobs,
-                         init_props_from_store)
+from .make_store import (process, processInchi,
+                         init_props_from_store, make_pool, iterJobs, run_jobs,
+                         store_rows, JOBS_PER_CPU)
 import multiprocessing, traceback
 from io import StringIO
 
@@ -145,9 +146,9 @@ def append_smiles(options):
         # never use more than the maximum number
         num_cpus = min(int(options.numprocs), multiprocessing.cpu_count())
             
-    pool = multiprocessing.Pool(num_cpus,
-                                initializer = init_props_from_store,
-                                initargs = (dbdir,))
+    pool = make_pool(num_cpus,
+                     initializer = init_props_from_store,
+                     initargs = (dbdir,))
         
     sm = MolFileIndex.MakeSmilesIndex(orig_filename, indexdir,
                                       sep=options.seperator,
@@ -187,92 +188,50 @@ def append_smiles(options):
 
         done = False
         count = start
+        numOutput = 0
         batchsize = options.batchsize
         badColumnWarning = False
-        inchies = {}
         names = {}
-        while 1:
-            lastcount = count
-            if options.nameColumn is not None:
-                joblist, count = getJobsAndNames(sm, options, count, numstructs, batchsize, num_cpus, names)
-            else:
-                joblist, count = getJobs(sm, options, count, numstructs, batchsize, num_cpus)
-                    
-            if not joblist:
-                logger.debug("Stopping")
-                break
-
-            t1 = time.time()
-            if d.inchikey:
-                results = pool.map(processInchi, joblist)
-            else:
-                results = pool.map(process, joblist)
+        if d.inchikey:
+            fn = processInchi
+        else:
+            fn = process
 
-                
-            procTime = time.time() - t1
-            
-            for result in results:
-                if not badColumnWarning and len(result) == 0:
-                    badColumnWarning = True
-                    logger.warning("no molecules processed in batch, check the smilesColumn")
-                    logger.warning("First 10 smiles:\n")
-                    logger.warning("\n".join(["%i: %s"%(i,sm.get(i)) for i in range(0, min(sm.N,10))]))
+        nprocs = JOBS_PER_CPU * num_cpus
+        batches = iterJobs(sm, options, count, numstructs,
+                           max(1, batchsize // JOBS_PER_CPU), nprocs,
+                           names if options.nameColumn is not None else None)
+        t1 = time.time()
+        for results in run_jobs(pool, fn, batches, nprocs):
+            indices, rows = results[:2]
+            if not badColumnWarning and len(indices) == 0:
+                badColumnWarning = True
+                logger.warning("no molecules processed in batch, check the smilesColumn")
+                logger.warning("First 10 smiles:\n")
+                logger.warning("\n".join(["%i: %s"%(i,sm.get(i)) for i in range(0, min(sm.N,10))]))
 
-                
-            flattened = [val for sublist in results for val in sublist]
-            flattened.sort()
+            store_rows(s, indices, rows, properties.GetColumns())
+            if d.inchikey:
+                for i, key in zip(indices.tolist(), results[2]):
+                    cabinet.append_index(key, i)
 
-            t1 = time.time()
-            delta = 0.0
-            # flatten the results so that we store them in index order
-            for result in flattened:
-                if d.inchikey:
-                    i,v,inchi,key = result
-                    if v:
-                        try:
-                            s.putRow(i, v)
-                        except ValueError:
-                            logger.exception("Columns: %s\nData: %r",
-                                              properties.GetColumns(),
-                                              v)
-                            raise
-                    if inchi in inchies:
-                        inchies[key].append(i)
-                    else:
-                        inchies[key] = [i]
-                elif options.nameColumn is not None:
-                    i,v = result
-                    if v:
-                        s.putRow(i, v)
-                            
-            storeTime = time.time() - t1
-            logger.info("Done with %s out of %s.  Processing time %0.2f store time %0.2f",
-                count, sm.N, procTime, storeTime)
+            numOutput += len(indices)
+            logger.info("Stored %s out of %s.  Elapsed time %0.2f",
+                numOutput, numstructs - start, time.time() - t1)
 
-        if d.inchikey:
-            t1 = time.time()
-            for k in sorted(inchies):
-                if k in cabinet or str.encode(k) in cabinet:
-                    l1 = cabinet.get(k)
-                    l = l1 + inchies[k]
-                    cabinet.set(k, l)
-                else:
-                    cabinet.set(k, inchies[k])
-            logger.info("... indexed in %2.2f seconds", (time.time()-t1))
-            
         if names:
             t1 = time.time()
-            for name in sorted(names):
+            for name, idx in names.items():
                 if name in name_cabinet or str.encode(name) in name_cabinet:
                     logger.error("Name %s already exists in database,"
                                   " keeping idx %s (duplicate idx is %s)",
-                                  name, name_cabinet[name], names[name])
+                                  name, name_cabinet[name], idx)
                 else:
-                    name_cabinet.set(name, names[name])
+                    name_cabinet.set(name, idx)
             logger.info("... indexed in %2.2f seconds", (time.time()-t1))
     finally:
         d.close()
-        pool.close()
+        pool.shutdown()
 
 # not thread safe!
 def append_store(options):
@@ -223,7 +223,7 @@ class DescriptorGenerator:
             results = self.processMols(mols, goodsmiles, internalParsing=True)
             if MAX_CACHE:
                 if len(indices) == len(smiles):
-                    for smile, res, m in zip(smiles, results, allmols):
+                    for smile, res, m in zip(smiles, results, mols):
                         self.cache[smile] = res, m
                     if keep_mols:
                         return mols, results
@@ -231,7 +231,7 @@ class DescriptorGenerator:
 
             # default values are None
             all_results = [None] * len(smiles)
-            for idx,result,m in zip(indices, results, allmols):
+            for idx,result,m in zip(indices, results, mols):
                 self.cache[smiles[idx]] = result,m
                 all_results[idx] = result
             if keep_mols:
@@ -246,7 +246,7 @@ class DescriptorGenerator:
                 all_results[i] = res
 
             # grab processed
-            for idx,result,m in zip(indices, results, allmols):
+            for idx,result,m in zip(indices, results, mols):
                 if MAX_CACHE:
                     self.cache[smiles[idx]] = result,m
                 all_results[idx] = result
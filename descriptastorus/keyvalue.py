@@ -1,6 +1,29 @@
 from .raw import Mode
-import logging
+import logging, numpy
 logger = logging.getLogger("descriptastorus")
+
+# Row index lists (see append_index) are stored as little endian uint32s
+#  after this prefix.  repr'd values never start with a NUL, older stores
+#  that saved index lists with set() are still readable.
+INDEX_PREFIX = b"\x00<u4"
+INDEX_DTYPE = numpy.dtype("<u4")
+
+def pack_index(indices):
+    """[row index, ...] -> packed bytes (without INDEX_PREFIX)"""
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    if len(indices) and (indices.min() < 0 or indices.max() > 0xffffffff):
+        raise ValueError("Row index out of range for the index format: %r"%(
+            indices.tolist()))
+    return indices.astype(INDEX_DTYPE).tobytes()
+
+def unpack_index(value):
+    """stored value -> [row index, ...]"""
+    if isinstance(value, str):
+        value = value.encode("latin-1")
+    if value.startswith(INDEX_PREFIX):
+        return numpy.frombuffer(value, dtype=INDEX_DTYPE,
+                                offset=len(INDEX_PREFIX)).tolist()
+    return list(eval(value))
     
 class KeyValueAPI:
     """Simple API to wrap various key value stores"""
@@ -47,6 +70,19 @@ class KeyValueAPI:
     def set(self, key, value):
         self.set_raw(key, repr(value))
 
+    def get_index(self, key, default=None):
+        """Get the row index list stored at key (see append_index)"""
+        try:
+            return unpack_index(self.get_raw(key))
+        except:
+            return default
+
+    def append_index(self, key, index):
+        """Append a row index to the packed list stored at key (the list
+        is created if the key doesn't exist)"""
+        indices = self.get_index(key, [])
+        self.set_raw(key, INDEX_PREFIX + pack_index(indices + [index]))
+
     
     def __contains__(self, k):
         return NotImplementedError
@@ -35,6 +35,9 @@ from .mode import Mode
 from rdkit.Chem import AllChem
 import pickle
 import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import (ProcessPoolExecutor, as_completed, wait,
+                                FIRST_COMPLETED)
 import time, os, sys, numpy, shutil
 import logging
 from descriptastorus import MolFileIndex, raw
@@ -103,61 +106,199 @@ def is_empty(result):
     
     return result.shape == 0
 
+# jobs are cut this much smaller than batchsize so that a slow job
+#  doesn't hold up the other workers
+JOBS_PER_CPU = 4
+
+def make_pool(num_cpus, initializer, initargs):
+    """Start the worker pool (a ProcessPoolExecutor, see run_jobs).
+    The resource tracker is started first so that the workers share it
+    with this process when attaching to the blocks made by share_jobs."""
+    if os.name == "posix":
+        resource_tracker.ensure_running()
+    return ProcessPoolExecutor(num_cpus,
+                               initializer=initializer,
+                               initargs=initargs)
+
+def share_jobs(jobs):
+    """jobs -> [(shm, shared_job), ...]
+    Packs the molecule data of each job into its own shared memory block.
+    A shared job is (block name, row indices, byte offsets) so only the
+    name and two small arrays are pickled to the workers.
+
+    The caller must close and unlink the blocks once the jobs are processed."""
+    res = []
+    for job in jobs:
+        data = [moldata.encode("utf-8") for _, moldata in job]
+        blob = b"".join(data)
+        shm = shared_memory.SharedMemory(create=True, size=max(len(blob), 1))
+        shm.buf[:len(blob)] = blob
+
+        offsets = numpy.zeros(len(data)+1, dtype=numpy.int64)
+        numpy.cumsum([len(x) for x in data], out=offsets[1:])
+        res.append((shm, (shm.name,
+                          numpy.array([i for i, _ in job], dtype=numpy.int64),
+                          offsets)))
+    return res
+
+def unshare_job(job):
+    """shared job -> [(index, moldata), ...]"""
+    name, indices, offsets = job
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        buf = shm.buf
+        res = [(index, bytes(buf[lo:hi]).decode("utf-8"))
+               for index, lo, hi in zip(indices.tolist(),
+                                        offsets[:-1].tolist(),
+                                        offsets[1:].tolist())]
+        # the block can't be closed while a view is exported
+        del buf
+    finally:
+        shm.close()
+    return res
+
+def run_jobs(pool, fn, batches, window):
+    """pool, fn, batches, window -> iterator over the job results as they finish
+    batches yields job lists (see getJobs).  Every job is shipped through
+    its own shared memory block which is released when its result is back.
+    At most window jobs are in flight so batches are only read as needed."""
+    blocks = {}
+    def finished(futures):
+        for future in futures:
+            shm = blocks.pop(future)
+            shm.close()
+            shm.unlink()
+            yield future.result()
+
+    try:
+        for jobs in batches:
+            for job in jobs:
+                if len(blocks) >= window:
+                    done, _ = wait(blocks, return_when=FIRST_COMPLETED)
+                    for result in finished(done):
+                        yield result
+                shm, job = share_jobs([job])[0]
+                blocks[pool.submit(fn, job)] = shm
+        for result in finished(as_completed(list(blocks))):
+            yield result
+    finally:
+        # only left over if we bailed out early
+        for future, shm in blocks.items():
+            future.cancel()
+            shm.close()
+            shm.unlink()
+
+def pack_rows(indices, results):
+    """row indices, descriptor results -> (indices, rows)
+    rows is a record array with the generator's columns so a job's
+    results pickle back to the driver as one block (see store_rows).
+    Results that don't cast losslessly (Nones, fractional or out of range
+    values in integer columns, overflow in float columns) stay a list so
+    that putRow can check them."""
+    indices = numpy.array(indices, dtype=numpy.int64)
+    # fields by position, generators can repeat column names
+    dtype = numpy.dtype([("f%d"%k, t)
+                         for k, (_, t) in enumerate(PROPS[0].GetColumns())])
+    if not results:
+        return indices, numpy.zeros(0, dtype=dtype)
+    if any(None in result for result in results):
+        return indices, list(results)
+    try:
+        rows = numpy.array([tuple(result) for result in results], dtype=dtype)
+        values = numpy.array(results, dtype=numpy.float64).reshape(len(results), -1)
+    except (TypeError, ValueError, OverflowError):
+        return indices, list(results)
+    if values.shape[1] != len(dtype) or not is_lossless(rows, values):
+        return indices, list(results)
+    return indices, rows
+
+def is_lossless(rows, values):
+    """rows, values -> True if the record array rows holds values
+    (a float64 array, one column per field) without truncation or overflow"""
+    for k, name in enumerate(rows.dtype.names):
+        column = rows[name]
+        if column.dtype.kind in "iu":
+            if not numpy.array_equal(column.astype(numpy.float64), values[:,k]):
+                return False
+        elif column.dtype.kind == "f":
+            # narrower floats round like struct.pack, but must not overflow
+            if not numpy.array_equal(numpy.isinf(column), numpy.isinf(values[:,k])):
+                return False
+    return True
+
+def store_rows(store, indices, rows, columns):
+    """Write a job's (indices, rows) (see pack_rows) into the raw store"""
+    if isinstance(rows, numpy.ndarray):
+        store.putRowsAt(indices, rows)
+        return
+    for i, v in zip(indices.tolist(), rows):
+        try:
+            store.putRow(i, v)
+        except ValueError:
+            logger.exception("Columns: %s\nData: %r", columns, v)
+            raise
+
 def process( job ):
+    """job -> (row indices, rows) for the molecules that were computed"""
+    if isinstance(job, tuple):
+        job = unshare_job(job)
     if job:
         logger.debug("Running on %s jobs from index %s to %s",
                         len(job), job[0][0], job[-1][0])
     else:
         logger.warning("Empty joblist")
 
-    res = []
     try:
         smiles = [s for _,s in job]
-        _, results = PROPS[0].processSmiles(smiles)
+        results = PROPS[0].processSmiles(smiles, keep_mols=False)
 
         if len(smiles) != len(results):
             logger.error("Failed batch from index %s to %s"%(
                 job[0][0], job[-1][0]))
-            return []
-                          
-        return tuple(((index, result)
-                      for (index,smiles), result in zip(job, results) if not is_empty(result)))
+            return pack_rows([], [])
+
+        keep = [k for k, result in enumerate(results) if not is_empty(result)]
+        return pack_rows([job[k][0] for k in keep], [results[k] for k in keep])
     
     except Exception as x:
         import traceback
         traceback.print_exc()
 
-    return res
+    return pack_rows([], [])
 
 def processInchi( job ):
+    """job -> (row indices, rows, inchikeys) for the molecules that were computed"""
+    if isinstance(job, tuple):
+        job = unshare_job(job)
     if job:
         logger.debug("Running on %s jobs from index %s to %s",
                         len(job), job[0][0], job[-1][0])
     else:
         logger.warning("Empty joblist")
 
-    res = []
+    indices, rows, keys = [], [], []
     try:
         smiles = [s for _,s in job]
         mols, results = PROPS[0].processSmiles(smiles)
         if len(smiles) != len(results):
             logger.error("Failed batch from index %s to %s"%(
                 job[0][0], job[-1][0]))
-            return []
+            return pack_rows([], []) + ([],)
         
         for i, ((index, smiles), result) in enumerate(zip(job, results)):
             m = mols[i]
             if not is_empty(result):
                 inchi = AllChem.MolToInchi(m)
                 key = AllChem.InchiToInchiKey(inchi)
-                res.append((index, result, inchi, key))
+                indices.append(index)
+                rows.append(result)
+                keys.append(key)
 
-        return res
     except Exception as x:
         import traceback
         traceback.print_exc()
 
-    return res
+    return pack_rows(indices, rows) + (keys,)
 
 def getJobsAndNames(molindex, options, start, end, batchsize, nprocs, names):
     jobs = []
@@ -165,8 +306,7 @@ def getJobsAndNames(molindex, options, start, end, batchsize, nprocs, names):
         jobs.append([])
 
     last = min(end, start+batchsize*nprocs)
-    for i in range(start, last):
-        moldata, name = molindex.get(i)
+    for i, (moldata, name) in enumerate(molindex.getBatch(start, last), start):
         if name in names:
             if options.hasHeader:
                 offset = 1
@@ -187,13 +327,26 @@ def getJobs(molindex, options, start, end, batchsize, nprocs):
         jobs.append([])
 
     last = min(end, start+batchsize*nprocs)
-    for i in range(start, last):
-        moldata = molindex.get(i)
+    for i, moldata in enumerate(molindex.getMolBatch(start, last), start):
         jobs[ i%nprocs ].append((i,moldata))
     # remove empty jobs        
     jobs = [ job for job in jobs if job ]
     return jobs, last
 
+def iterJobs(molindex, options, start, end, batchsize, nprocs, names=None):
+    """Yield the job lists for rows [start, end) a batch at a time,
+    recording the names as well if names is not None (see getJobsAndNames)"""
+    while 1:
+        if names is not None:
+            joblist, start = getJobsAndNames(molindex, options, start, end, batchsize, nprocs, names)
+        else:
+            joblist, start = getJobs(molindex, options, start, end, batchsize, nprocs)
+        if not joblist:
+            break
+        # the next batch is read from disk while this one is processed
+        molindex.prefetch(start, min(end, start + batchsize*nprocs))
+        yield joblist
+
 # not thread safe!
 def make_store(options):
     properties = init_props(options.descriptors)[0]
@@ -218,9 +371,9 @@ def make_store(options):
         # never use more than the maximum number
         num_cpus = min(int(options.numprocs), multiprocessing.cpu_count())
             
-    pool = multiprocessing.Pool(num_cpus,
-                                initializer=init_props,
-                                initargs=(options.descriptors,))
+    pool = make_pool(num_cpus,
+                     initializer=init_props,
+                     initargs=(options.descriptors,))
 
     os.mkdir(options.storage)
     with open(os.path.join(options.storage, "__options__"), 'wb') as f:
@@ -267,86 +420,44 @@ def make_store(options):
         batchsize = options.batchsize
         badColumnWarning = False
         
-        inchies = {}
         names = {}
-        if 1:
-        #with tqdm.tqdm(total=sm.N) as pbar:
-        #    pbar.set_description("Processing")
-            while 1:
-                lastcount = count
-
-                if options.nameColumn is not None:
-                    joblist, count = getJobsAndNames(sm, options, count, numstructs, batchsize, num_cpus, names)
-                else:
-                    joblist, count = getJobs(sm, options, count, numstructs, batchsize, num_cpus)
-
-                if not joblist:
-                    break
-
-
-                t1 = time.time()
-                if options.index_inchikey:
-                    results = pool.map(processInchi, joblist)
-                else:
-                    results = pool.map(process, joblist)
-
-                #pbar.update(count-lastcount)
-                procTime = time.time() - t1
-
-                for result in results:
-                    numOutput += len(result)
-                    if numOutput == 0 and not badColumnWarning and len(result) == 0:
-                        badColumnWarning = True
-                        logger.warning("no molecules processed in batch, check the smilesColumn")
-                        logger.warning("First 10 smiles:\n")
-                        logger.warning("\n".join(["%i: %s"%(i,sm.get(i)) for i in range(0, min(sm.N,10))]))
-
-
-                flattened = [val for sublist in results for val in sublist]
-                flattened.sort()
-
-                t1 = time.time()
-                delta = 0.0
-                # flatten the results so that we store them in index order
-                for result in flattened:
-                    if options.index_inchikey:
-                        i,v,inchi,key = result
-                        if not is_empty(v):
-                            try:
-                                s.putRow(i, v)
-                            except ValueError:
-                                logger.exception("Columns: %s\nData: %r",
-                                                  properties.GetColumns(),
-                                                  v)
-                                raise
-                        if inchi in inchies:
-                            inchies[key].append(i)
-                        else:
-                            inchies[key] = [i]
-
-                    else:
-                        i,v = result
-                        if not is_empty(v):
-                            s.putRow(i, v)
-
-                storeTime = time.time() - t1
-                logger.debug("Done with %s out of %s.  Processing time %0.2f store time %0.2f",
-                    count, sm.N, procTime, storeTime)
-
-        if cabinet and options.index_inchikey:
-            logger.info("Indexing inchies")
-            t1 = time.time()
-            for k in sorted(inchies):#tqdm.tqdm(sorted(inchies)):
-                cabinet.set(k, inchies[k])
-            logger.info("... indexed in %2.2f seconds", (time.time()-t1))
-            
+        if options.index_inchikey:
+            fn = processInchi
+        else:
+            fn = process
+
+        nprocs = JOBS_PER_CPU * num_cpus
+        batches = iterJobs(sm, options, count, numstructs,
+                           max(1, batchsize // JOBS_PER_CPU), nprocs,
+                           names if options.nameColumn is not None else None)
+        t1 = time.time()
+        # results stream back in completion order while the next jobs
+        #  are submitted, the raw store is random access so order is irrelevant
+        for results in run_jobs(pool, fn, batches, nprocs):
+            indices, rows = results[:2]
+            numOutput += len(indices)
+            if numOutput == 0 and not badColumnWarning and len(indices) == 0:
+                badColumnWarning = True
+                logger.warning("no molecules processed in batch, check the smilesColumn")
+                logger.warning("First 10 smiles:\n")
+                logger.warning("\n".join(["%i: %s"%(i,sm.get(i)) for i in range(0, min(sm.N,10))]))
+
+            store_rows(s, indices, rows, properties.GetColumns())
+            if options.index_inchikey and cabinet is not None:
+                for i, key in zip(indices.tolist(), results[2]):
+                    cabinet.append_index(key, i)
+
+            logger.debug("Stored %s out of %s.  Elapsed time %0.2f",
+                         numOutput, sm.N, time.time() - t1)
+
         if name_cabinet:
             t1 = time.time()
             logger.info("Indexing names")
-            for name in sorted(names):#tqdm.tqdm(sorted(names)):
-                name_cabinet.set(name, names[name])
+            # the name store is a hash db, write order doesn't matter
+            for name, idx in names.items():
+                name_cabinet.set(name, idx)
             logger.info("... indexed in %2.2f seconds", (time.time()-t1))
     finally:
         sm.close()
         s.close()
-        pool.close()
+        pool.shutdown()
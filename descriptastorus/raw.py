@@ -41,6 +41,7 @@ Data can be updated using putRow when opened in append mode.
 from __future__ import print_function
 from .mode import Mode
 import pickle, numpy, os, mmap, struct, sys, shutil
+from numpy.lib import recfunctions
 import logging
 import six
 
@@ -62,6 +63,20 @@ class RawStoreIter:
             raise StopIteration()
         return self.raw.get(self.i)
 
+# struct format character -> numpy type
+NUMPY_TYPES = {
+    "i": "i4",
+    "q": "i8",
+    "B": "u1",
+    "H": "u2",
+    "I": "u4",
+    "Q": "u8",
+    "e": "f2",
+    "f": "f4",
+    "d": "f8",
+    "?": "?",
+    }
+
 def convert_string( v ):
     if type(v) == str:
         return str.encode(v)
@@ -93,6 +108,7 @@ class RawStore:
         colCache = self.colCacheDir = os.path.join(directory, "__colstore___")
 
         self._f = None
+        self._rows = None
         self.mode = mode
         self._openfile()
 
@@ -119,11 +135,26 @@ class RawStore:
 
         if self._f is not None:
             self.f = mmap.mmap(self._f.fileno(), 0, access=access)
+            # read only record view of the whole store for getRange
+            try:
+                self._rows = numpy.frombuffer(
+                    self.f, dtype=self.getNumpyDtype(),
+                    count=min(self.N, len(self.f) // self.rowbytes))
+                self._rows.flags.writeable = False
+            except (KeyError, ValueError, TypeError):
+                logger.debug("No record view for %s, using reads", self.fname)
+                self._rows = None
         else:
             self._f = self.f
 
     def close(self):
-        self.f.close()
+        self._rows = None
+        try:
+            self.f.close()
+        except BufferError:
+            # ranges handed out by getRange still point into the map,
+            #  it is unmapped when the last of them goes away
+            pass
         self._f.close()
 
     def __len__(self):
@@ -206,6 +237,20 @@ class RawStore:
             return tuple([ tostr(x)
                            if isinstance(x, (str, bytes)) else x for x in res ])
 
+    def getRange(self, start, end):
+        """Return rows [start, end) as a numpy record array (see getNumpyDtype)
+        For memory mapped stores this is a read only view into the map,
+        copy it to keep it past writes to those rows."""
+        if start < 0 or end > self.N or start > end:
+            raise IndexError("Range out of range %s:%s (0 < %s)"%(
+                             start, end, self.N))
+        if self._rows is not None:
+            # doesn't move the file position, safe to use next to get()
+            return self._rows[start:end]
+        self.f.seek(start * self.rowbytes, 0)
+        _bytes = self.f.read((end - start) * self.rowbytes)
+        return numpy.frombuffer(_bytes, dtype=self.getNumpyDtype())
+
     def getEndian(self):
         if self.pack_format[0] in "@<>!=":
             return self.pack_format[0]
@@ -230,6 +275,26 @@ class RawStore:
 
         return endian, types
 
+    def getNumpyDtype(self):
+        """Return the numpy record dtype matching the on-disk row layout
+        (fields are f0, f1, ... if the column names aren't unique)"""
+        endian, formats = self.getColFormats()
+        if endian == "@":
+            # native alignment pads the fields, not a packed record
+            raise ValueError("No packed record layout for %r" % self.pack_format)
+        if endian == "!":
+            endian = ">"
+        names = self.colnames
+        if len(set(names)) != len(names):
+            names = ["f%d"%i for i in range(len(formats))]
+        fields = []
+        for name, fmt in zip(names, formats):
+            if fmt[-1] == "s":
+                fields.append((name, "S" + fmt[:-1]))
+            else:
+                fields.append((name, endian + NUMPY_TYPES[fmt]))
+        return numpy.dtype(fields)
+
     def getFormatAndBytesForColumn(self, i):
         endian, formats = self.getColFormats()
         bytes = struct.calcsize(formats[i])
@@ -436,6 +501,54 @@ class RawStore:
                            os.path.getsize(self.fname))
             raise
 
+    def putRows(self, idx, rows):
+        """Put a contiguous block of rows starting at row idx with a single copy.
+        rows is a numpy record array with the layout of getNumpyDtype or
+        a (nrows, ncolumns) array (1D for single column stores).
+        Unlike putRow, values are cast without checking."""
+        rows = self._asRecords(rows)
+        if idx < 0 or idx + len(rows) > self.N:
+            raise IndexError("Attempting to write rows %s to %s, raw store only has %d rows"%(
+                idx, idx + len(rows), self.N))
+
+        offset = idx * self.rowbytes
+        _bytes = rows.tobytes()
+        self.f[offset:offset+len(_bytes)] = _bytes
+
+    def putRowsAt(self, indices, rows):
+        """Put rows at the given (not necessarily contiguous) row indices
+        with a single scattered copy.
+        rows is as for putRows, values are cast without checking."""
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        rows = self._asRecords(rows)
+        if len(indices) != len(rows):
+            raise ValueError("Got %s row indices for %s rows"%(
+                len(indices), len(rows)))
+        if len(indices) and (indices.min() < 0 or indices.max() >= self.N):
+            raise IndexError("Attempting to write rows %s to %s, raw store only has %d rows"%(
+                indices.min(), indices.max(), self.N))
+
+        if isinstance(self.f, mmap.mmap):
+            view = numpy.frombuffer(self.f, dtype=rows.dtype, count=self.N)
+            view[indices] = rows
+            # the map can't be closed while a view is exported
+            del view
+        else:
+            for idx, row in zip(indices.tolist(), rows):
+                self.f.seek(idx * self.rowbytes, 0)
+                self.f.write(row.tobytes())
+
+    def _asRecords(self, rows):
+        """rows -> rows as a record array with the layout of getNumpyDtype"""
+        rows = numpy.asarray(rows)
+        dtype = self.getNumpyDtype()
+        if rows.dtype.names is None:
+            rows = recfunctions.unstructured_to_structured(
+                rows.reshape(len(rows), -1), dtype=dtype)
+        elif rows.dtype != dtype:
+            rows = rows.astype(dtype)
+        return rows
+
     def write(self, row):
         """Writes row with no datatype checking to the end of the file.
         Do not use with putRow/getRow
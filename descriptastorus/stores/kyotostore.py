@@ -1,4 +1,4 @@
-from ..keyvalue import KeyValueAPI
+from ..keyvalue import KeyValueAPI, INDEX_PREFIX, pack_index, unpack_index
 from ..raw import Mode
 import logging, os
 
@@ -7,6 +7,18 @@ logger = logging.getLogger("descriptastorus")
 try:
     import kyotocabinet
 
+    class IndexAppender(kyotocabinet.Visitor):
+        """Appends the packed self.index to the index list at the visited key"""
+        index = b""
+        def visit_full(self, key, value):
+            if not value.startswith(INDEX_PREFIX):
+                # older repr'd list
+                value = INDEX_PREFIX + pack_index(unpack_index(value))
+            return value + self.index
+
+        def visit_empty(self, key):
+            return INDEX_PREFIX + self.index
+
     class KyotoStore(KeyValueAPI):
         STORE = "kyotocabinet"
         def open(self, fn, mode):
@@ -36,6 +48,12 @@ try:
         def set_raw(self, key, value):
             self.cabinet[key] = value
 
+        def append_index(self, key, index):
+            # single lookup read-modify-write
+            appender = IndexAppender()
+            appender.index = pack_index([index])
+            self.cabinet.accept(key, appender)
+
         def __contains__(self, key):
             return key in self.cabinet
         
@@ -4,7 +4,7 @@ from rdkit.Chem import AllChem
 import numpy, math
 from descriptastorus import make_store, DescriptaStore
 from descriptastorus.descriptors.DescriptorGenerator import DescriptorGenerator
-import contextlib, tempfile, os, shutil, sys
+import contextlib, tempfile, os, shutil, sys, struct
 import datahook
 make_store.DEFAULT_KEYSTORE = "dbmstore"
 
@@ -40,6 +40,21 @@ class NanDescriptorsWithCalcFlags(DescriptorGenerator):
     
 descriptors = NanDescriptorsWithCalcFlags()
 
+# values numpy would truncate or overflow must still be rejected
+class LossyDescriptors(DescriptorGenerator):
+    NAME="LossyDescriptors"
+    def __init__(self):
+        DescriptorGenerator.__init__(self)
+        self.columns =[('a', numpy.uint8),
+                       ('b', numpy.float32)]
+
+    def calculateMol(self, m, smiles, internalParsing):
+        if smiles.startswith("CC"):
+            return [1, 1e39]
+        return [1.7, 1.0]
+
+LossyDescriptors()
+
 class TestCase(unittest.TestCase):
     def testRawNones(self):
         try:
@@ -95,5 +110,35 @@ class TestCase(unittest.TestCase):
             if os.path.exists(storefname):
                 shutil.rmtree(storefname)
 
+    def testLossyValues(self):
+        make_store.init_props("LossyDescriptors")
+        indices, rows = make_store.pack_rows([0], [[True, 1, 2.5]])
+        self.assertTrue(isinstance(rows, numpy.ndarray))
+        self.assertEqual(rows.tolist(), [(True, 1, 2.5)])
+        for result in ([True, 1.7, 1.0], [True, numpy.float64(2.5), 1.0],
+                       [True, 300, 1.0], [True, -1, 1.0], [True, 1, 1e39]):
+            indices, rows = make_store.pack_rows([0], [result])
+            self.assertEqual(rows, [result])
+
+        for smiles in ("c1ccccc1 0", "CCc1ccccc1 0"):
+            try:
+                fname = tempfile.mktemp()+".smi"
+                storefname = tempfile.mktemp()+".store"
+                with open(fname, 'w') as f:
+                    f.write(smiles)
+
+                opts = make_store.MakeStorageOptions( storage=storefname, smilesfile=fname,
+                                                      hasHeader=False,
+                                                      smilesColumn=0, nameColumn=1,
+                                                      seperator=" ", descriptors="LossyDescriptors",
+                                                      index_inchikey=True )
+                self.assertRaises((struct.error, OverflowError),
+                                  make_store.make_store, opts)
+            finally:
+                if os.path.exists(fname):
+                    os.unlink(fname)
+                if os.path.exists(storefname):
+                    shutil.rmtree(storefname)
+
 if __name__ == '__main__':  #pragma: no cover
     unittest.main()
@@ -5,7 +5,7 @@ from descriptastorus.descriptors import rdDescriptors
 from descriptastorus.descriptors import MakeGenerator
 import contextlib, sys
 
-import numpy, os, shutil
+import numpy, os, pickle, shutil
 
 class TestCase(unittest.TestCase):
     def test_raw(self):
@@ -80,6 +80,112 @@ class TestCase(unittest.TestCase):
             if os.path.exists(directory):
                 shutil.rmtree(directory)                
 
+    def testPutRows(self):
+        try:
+            directory = "test-store"
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+            cols = [('flag', bool), ('count', numpy.uint8), ('value', numpy.float64)]
+            with contextlib.closing(raw.MakeStore(cols, 10, directory)) as r:
+                rows = numpy.array([[1, i, i/2.] for i in range(8)])
+                r.putRows(2, rows)
+                for i in range(8):
+                    self.assertEqual(r.get(i+2), (True, i, i/2.))
+                self.assertEqual(r.get(0), (False, 0, 0.))
+
+                self.assertRaises(IndexError, r.putRows, 3, rows)
+
+            with contextlib.closing(raw.MakeStore([('index', numpy.uint32)], 10, directory,
+                                                  checkDirectoryExists=False)) as r:
+                r.putRows(0, numpy.arange(10, dtype=numpy.uint32))
+                for i in range(10):
+                    self.assertEqual(r.get(i), (i,))
+        finally:
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+    def testPutRowsAt(self):
+        try:
+            directory = "test-store"
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+            cols = [('flag', bool), ('count', numpy.uint8), ('value', numpy.float64)]
+            with contextlib.closing(raw.MakeStore(cols, 10, directory)) as r:
+                # field names and types are cast by position
+                rows = numpy.array([(True, 3, .5), (True, 9, 4.5)],
+                                   dtype=[('a', bool), ('b', numpy.int64), ('c', numpy.float32)])
+                r.putRowsAt([7, 2], rows)
+                self.assertEqual(r.get(7), (True, 3, .5))
+                self.assertEqual(r.get(2), (True, 9, 4.5))
+                self.assertEqual(r.get(3), (False, 0, 0.))
+
+                r.putRowsAt([], rows[:0])
+                self.assertRaises(IndexError, r.putRowsAt, [1, 10], rows)
+                self.assertRaises(ValueError, r.putRowsAt, [1], rows)
+        finally:
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+    def testGetRange(self):
+        try:
+            directory = "test-store"
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+            cols = [('count', numpy.uint8), ('value', numpy.float64)]
+            r = raw.MakeStore(cols, 10, directory)
+            r.putRows(0, numpy.array([[i, i/2.] for i in range(10)]))
+
+            rows = r.getRange(3, 6)
+            self.assertEqual(rows["count"].tolist(), [3, 4, 5])
+            self.assertEqual(rows["value"].tolist(), [1.5, 2., 2.5])
+            self.assertEqual(len(r.getRange(4, 4)), 0)
+            self.assertRaises(IndexError, r.getRange, 8, 11)
+            # a view into the store, not a copy
+            self.assertFalse(rows.flags.writeable)
+            r.putRow(4, [40, 20.])
+            self.assertEqual(rows["count"].tolist(), [3, 40, 5])
+
+            # closing while a range is still held is fine
+            r.close()
+            self.assertEqual(rows["count"].tolist(), [3, 40, 5])
+        finally:
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+    def testNetworkOrder(self):
+        try:
+            directory = "test-store"
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
+            cols = [('count', numpy.int32), ('value', numpy.float64)]
+            raw.MakeStore(cols, 10, directory).close()
+            # stores written with a "!" pack format
+            fmt = os.path.join(directory, "__rawformat__")
+            with open(fmt, 'rb') as f:
+                opts = pickle.load(f)
+            opts['pack_format'] = "!" + opts['pack_format'][1:]
+            with open(fmt, 'wb') as f:
+                pickle.dump(opts, f)
+
+            r = raw.RawStore(directory, mode=raw.Mode.WRITE)
+            for i in range(10):
+                r.putRow(i, [i, i/2.])
+            r.close()
+
+            r = raw.RawStore(directory)
+            self.assertEqual(r.get(3), (3, 1.5))
+            rows = r.getRange(3, 6)
+            self.assertEqual(rows["count"].tolist(), [3, 4, 5])
+            self.assertEqual(rows["value"].tolist(), [1.5, 2., 2.5])
+            r.close()
+        finally:
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+
     def testAppend(self):
         directory1 = "test-store-1"
         if os.path.exists(directory1):
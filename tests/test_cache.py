@@ -54,6 +54,25 @@ class TestCase(unittest.TestCase):
         m1, res = d.processSmiles(smiles)
         self.assertEqual(d.cache_miss, 1)
         self.assertEqual(res[0], None)
+
+    def testCacheWithBadSmiles(self):
+        d.cache.clear()
+        smiles = ["C" * i for i in range(1,10)]
+        smiles.insert(3, "X")
+        res = d.processSmiles(smiles, keep_mols=False)
+        self.assertEqual(res, [None if s == "X" else [True, len(s)]
+                               for s in smiles])
+
+        # cached mols must line up with their smiles
+        for smile in smiles:
+            if smile != "X":
+                _, m = d.cache[smile]
+                self.assertEqual(AllChem.MolToSmiles(m), smile)
+
+        mols, res2 = d.processSmiles(smiles)
+        self.assertEqual(res, res2)
+        self.assertEqual([m and AllChem.MolToSmiles(m) for m in mols],
+                         [None if s == "X" else s for s in smiles])
                 
 if __name__ == '__main__':  #pragma: no cover
     unittest.main()
@@ -36,6 +36,16 @@ class TestKeyValue(unittest.TestCase):
 
             s.set('1', [1,2,3,4])
             self.assertEqual(s.get('1'), [1,2,3,4])
+
+            # older stores saved index lists with set()
+            s.set('a', [1,2,3,4])
+            s.append_index('a', 5)
+            s.append_index('b', 0)
+            s.append_index('b', 2**32-1)
+            self.assertEqual(s.get_index('a'), [1,2,3,4,5])
+            self.assertEqual(s.get_index('b'), [0, 2**32-1])
+            self.assertEqual(s.get_index('c'), None)
+            self.assertRaises(ValueError, s.append_index, 'b', 2**32)
             
     def test_set_get_dbm(self):
         store = keyvalue.KeyValueAPI.get_store("dbmstore")
@@ -49,10 +59,22 @@ class TestKeyValue(unittest.TestCase):
         
         s.set('1', [1,2,3,4])
         self.assertEqual(s.get('1'), [1,2,3,4])
+
+        # older stores saved index lists with set()
+        s.set('a', [1,2,3,4])
+        s.append_index('a', 5)
+        s.append_index('b', 0)
+        s.append_index('b', 2**32-1)
+        self.assertRaises(ValueError, s.append_index, 'b', -1)
         s.close()
 
         s.open(fn, Mode.READONLY)
         self.assertEqual(s.get('1'), [1,2,3,4])
+        self.assertEqual(s.get_index('a'), [1,2,3,4,5])
+        self.assertEqual(s.get_index('b'), [0, 2**32-1])
+        self.assertEqual(s.get_index('c'), None)
+        self.assertEqual(s.get_raw('b'),
+                         keyvalue.INDEX_PREFIX + keyvalue.pack_index([0, 2**32-1]))
         s.close()
 
         
@@ -0,0 +1,68 @@
+import unittest
+from descriptastorus import MolFileIndex
+from rdkit import Chem
+import os, shutil, tempfile
+import numpy
+import logging
+
+TEST_DIR = "test-sdf-index"
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(TEST_DIR):
+            shutil.rmtree(TEST_DIR, ignore_errors=True)
+        self.smiles = ["C", "CC", "c1ccccc1", "CCO"]
+        fd, self.sdf = tempfile.mkstemp(suffix=".sdf")
+        os.close(fd)
+        w = Chem.SDWriter(self.sdf)
+        for i, smi in enumerate(self.smiles):
+            m = Chem.MolFromSmiles(smi)
+            m.SetProp("_Name", "mol%d"%i)
+            w.write(m)
+        w.close()
+
+    def tearDown(self):
+        if os.path.exists(TEST_DIR):
+            shutil.rmtree(TEST_DIR, ignore_errors=True)
+        os.unlink(self.sdf)
+
+    def testIndexing(self):
+        index = MolFileIndex.MakeSDFIndex(self.sdf, TEST_DIR)
+        self.assertEqual(index.N, len(self.smiles))
+        for i, smi in enumerate(self.smiles):
+            self.assertEqual(index.getName(i), "mol%d"%i)
+            self.assertEqual(Chem.MolToSmiles(index.getRDMol(i)),
+                             Chem.CanonSmiles(smi))
+        index.close()
+
+    def testFindAllAcrossChunks(self):
+        with open(self.sdf, 'rb') as f:
+            data = f.read()
+        expected = []
+        pos = data.find(b"$$$$\n")
+        while pos != -1:
+            expected.append(pos)
+            pos = data.find(b"$$$$\n", pos+1)
+        for chunksize in (3, 7, 64, 2**26):
+            self.assertEqual(
+                list(MolFileIndex.findall(self.sdf, b"$$$$\n", chunksize)),
+                expected)
+
+    def testScan(self):
+        # the threaded scanner (plain python without numba)
+        with open(self.sdf, 'rb') as f:
+            data = f.read()
+        buf = numpy.frombuffer(data, dtype=numpy.uint8)
+        for word in (b"\n", b"$$$$\n"):
+            needle = numpy.frombuffer(word, dtype=numpy.uint8)
+            m = len(data) - len(word) + 1
+            expected = numpy.flatnonzero(
+                [data.startswith(word, i) for i in range(m)])
+            for nparts in (1, 3, 64):
+                self.assertEqual(
+                    list(MolFileIndex._scan(buf, needle, m, nparts)),
+                    list(expected))
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    unittest.main()
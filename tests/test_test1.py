@@ -2,6 +2,7 @@ import unittest
 from descriptastorus import MolFileIndex
 import os, shutil
 import logging
+from unittest import mock
 
 import datahook
 
@@ -28,6 +29,96 @@ class TestCase(unittest.TestCase):
 
         self.assertEqual(self.index.getRDMol(13), None)
 
+    def testMolBatch(self):
+        mols = [self.index.getMol(i) for i in range(self.index.N)]
+        self.assertEqual(self.index.getMolBatch(0, self.index.N), mols)
+        self.assertEqual(self.index.getMolBatch(3, 7), mols[3:7])
+        self.assertEqual(self.index.getMolBatch(5, 5), [])
+
+        rows = [self.index.get(i) for i in range(self.index.N)]
+        self.assertEqual(self.index.getBatch(0, self.index.N), rows)
+        self.assertEqual(self.index.getBatch(12, 14),
+                         [('c1ccccc1CCCCCCCCCCCC', '13'), rows[13]])
+
+    def testPrefetch(self):
+        # only a hint, must be fine anywhere in the file
+        N = self.index.N
+        for start, end in ((0, N), (3, 7), (N-1, N), (5, 5), (N, N)):
+            self.index.prefetch(start, end)
+        self.assertEqual(self.index.getMolBatch(N-1, N), [self.index.getMol(N-1)])
+
+    def testPositionalReads(self):
+        # files that can't be mapped are read with pread
+        N = self.index.N
+        nomap = mock.Mock(wraps=MolFileIndex.mmap)
+        nomap.mmap.side_effect = OSError("can't mmap")
+        with mock.patch.object(MolFileIndex, "mmap", nomap):
+            index = MolFileIndex.MolFileIndex(TEST_DIR)
+        try:
+            self.assertEqual(index.mm, None)
+            self.assertEqual(index.header(), self.index.header())
+            self.assertEqual([index.get(i) for i in range(N)],
+                             [self.index.get(i) for i in range(N)])
+            self.assertEqual(index.getMolBatch(0, N), self.index.getMolBatch(0, N))
+            self.assertEqual(index.getBatch(3, 7), self.index.getBatch(3, 7))
+            for start, end in ((0, N), (N-1, N), (5, 5)):
+                index.prefetch(start, end)
+        finally:
+            index.close()
+
+    def testField(self):
+        # fields cut straight from the bytes must match the csv reader
+        fname = os.path.join(TEST_DIR, "fields.csv")
+        lines = ['smiles,name,other',
+                 'CCC,one,x',
+                 '  CCO,  two  ,',
+                 '"C,C",three,y',
+                 'CCN,,z',
+                 'CCCl,five']
+        with open(fname, 'w') as f:
+            f.write("\r\n".join(lines))
+        index = MolFileIndex.MakeSmilesIndex(
+            fname, TEST_DIR + "-fields", hasHeader=True,
+            smilesColumn="smiles", nameColumn="name", sep=",")
+        try:
+            for i in range(index.N):
+                row = index._get(i)
+                buf = index._getBytes(i)
+                for col in range(3):
+                    if col < len(row):
+                        self.assertEqual(index._parser(col)(buf), row[col])
+                    else:
+                        self.assertRaises(IndexError, index._parser(col), buf)
+            self.assertEqual(index.getMolBatch(0, index.N),
+                             ['CCC', 'CCO', 'C,C', 'CCN', 'CCCl'])
+            self.assertEqual(index.getName(1), 'two  ')
+            self.assertEqual(index.get(3), ('CCN', ''))
+            self.assertEqual(index.getBatch(1, 3),
+                             [('CCO', 'two  '), ('C,C', 'three')])
+        finally:
+            index.close()
+            shutil.rmtree(TEST_DIR + "-fields", ignore_errors=True)
+
+    def testFieldCarriageReturns(self):
+        # fallback rows go to the csv parser exactly as they are in the file
+        fname = os.path.join(TEST_DIR, "returns.smi")
+        with open(fname, 'wb') as f:
+            f.write(b'smiles name\nCCC one\n;\t "b\r\r\nCCO two\r\r\n')
+        index = MolFileIndex.MakeSmilesIndex(
+            fname, TEST_DIR + "-returns", hasHeader=True,
+            smilesColumn="smiles", nameColumn="name", sep=" ")
+        try:
+            for i in range(index.N):
+                row = index._get(i)
+                self.assertEqual(index.getMol(i), row[0])
+                self.assertEqual(index.getName(i), row[1])
+                self.assertEqual(index.get(i), tuple(row))
+            self.assertEqual(index.getName(1), 'b\r')
+            self.assertEqual(index.getBatch(0, index.N),
+                             [tuple(index._get(i)) for i in range(index.N)])
+        finally:
+            index.close()
+            shutil.rmtree(TEST_DIR + "-returns", ignore_errors=True)
 
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)